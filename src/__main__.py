@@ -1,40 +1,101 @@
 from __future__ import annotations
 
-import argparse
-import asyncio
-import locale
+import time
 
-from loguru import logger
+_IMPORT_STARTED = time.perf_counter()
 
-from .components import MockedTwitter, client
-from .tasks import scrutins
+import argparse  # noqa: E402
+import asyncio  # noqa: E402
+import os  # noqa: E402
+import signal  # noqa: E402
+import sys  # noqa: E402
 
+from loguru import logger  # noqa: E402
 
-async def main():
-    bot = client.instance()
+from .components import (  # noqa: E402
+    MockedTwitter,
+    client,
+    logs,
+    metrics,
+    task,
+    watchdog,
+)
+from .tasks import scrutins  # noqa: E402
+
+IMPORT_TIME = time.perf_counter() - _IMPORT_STARTED
+
+
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--dev", action="store_true",
                         default=False, help="Run in development mode")
-    args = parser.parse_args()
+    parser.add_argument("--check-import-budget", action="store_true", default=False,
+                        help="Exit with an error if the import time exceeds IMPORT_BUDGET_MS")
+    return parser.parse_args()
+
+
+def check_import_budget() -> bool:
+    """
+    Compare the time spent importing the bot to the IMPORT_BUDGET_MS environment variable,
+    250ms by default.
+
+    :return: True if the import time is within the budget.
+    """
+    # ? heavy dependencies (tweepy, aiohttp, Pillow) must stay out of the import path
+    budget_ms = float(os.getenv("IMPORT_BUDGET_MS", "250"))
+    import_ms = IMPORT_TIME * 1000
+    if import_ms > budget_ms:
+        logger.warning(f"Imports took {import_ms:.1f}ms, over the {budget_ms:.0f}ms budget")
+        return False
+
+    logger.debug(f"Imports took {import_ms:.1f}ms")
+    return True
+
+
+async def main(args: argparse.Namespace):
+    bot = client.instance()
 
     if args.dev:
         logger.info("Running in development mode")
         bot.tw_client = bot.tw_api_V1 = MockedTwitter()  # type: ignore
 
+    watchdog.LoopWatchdog().start()
+    metrics.report_metrics.start()
+
+    # ? `kill -USR1 <pid>` profiles the next run of every task
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, task.profile_all)
+
+    scrutins.send_heartbeat.start(bot)
     scrutins.get_scrutins_task.start(bot)
     scrutins.create_post.start(bot)
     # scrutins.upload_scrutin_media.start(bot)
 
-    # ? run the bot forever
+    # ? run the bot until stopped, `docker stop` sends a SIGTERM
     event = asyncio.Event()
-    await event.wait()
+    if hasattr(signal, "SIGTERM"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, event.set)
+    try:
+        await event.wait()
+    finally:
+        scrutins.shutdown(bot)
 
 
 if __name__ == "__main__":
     from dotenv import load_dotenv
 
+    args = parse_args()
     load_dotenv(".env")
+    logs.setup()
+
+    within_budget = check_import_budget()
+    if args.check_import_budget:
+        sys.exit(0 if within_budget else 1)
+
     try:
-        asyncio.run(main())
+        asyncio.run(main(args))
     except KeyboardInterrupt:
         logger.info("Bot shutdown")
+    finally:
+        # ? wait for the background sink to write the queued records
+        logger.complete()
@@ -1,3 +1,4 @@
 from .client import Client
+from .coordination import ClaimLost, Coordinator, SQLiteCoordinator
 from .mocked_twitter import MockedTwitter
 from .task import Task
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+
+def artifacts_dir() -> Path:
+    """
+    Directory holding the files produced by the posting stages, from the ARTIFACTS_DIR
+    environment variable, defaulting to data/artifacts.
+
+    :return: The artifacts directory, created if missing.
+    """
+    path = Path(os.getenv("ARTIFACTS_DIR", "data/artifacts"))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def artifact_path(scrutin_id: int, suffix: str) -> str:
+    """
+    :param scrutin_id: The id of the scrutin the artifact belongs to.
+    :param suffix: The file suffix, e.g. ".json" or ".jpg".
+    :return: The path of the artifact.
+    """
+    return str(artifacts_dir() / f"scrutin_{scrutin_id}{suffix}")
+
+
+def write_artifact(path: str, content: bytes) -> None:
+    """
+    Write an artifact atomically and flush it to disk, so a checkpoint referencing it
+    never points to a partial file.
+
+    :param path: The path of the artifact.
+    :param content: The content to write.
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_artifact(path: str) -> bytes:
+    """
+    :param path: The path of the artifact.
+    :return: The content of the artifact.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def remove_artifacts(scrutin_id: int) -> None:
+    """
+    Remove every artifact of a scrutin, once it is committed.
+
+    :param scrutin_id: The id of the scrutin.
+    """
+    for path in artifacts_dir().glob(f"scrutin_{scrutin_id}.*"):
+        path.unlink(missing_ok=True)
@@ -4,14 +4,18 @@ import inspect
 import json
 import os
 from dataclasses import dataclass
-from typing import Any, Callable, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
 
-import aiofiles
-import tweepy
 from loguru import logger
 
+from .coordination import Coordinator, SQLiteCoordinator
 from .task import Task
 
+if TYPE_CHECKING:
+    import tweepy
+
+    from .vote_matrix import VoteMatrix
+
 _client = None
 
 
@@ -44,24 +48,86 @@ def anon_key(key: str) -> str:
 class Client:
     tasks: List[Task]
     listeners: Dict[str, List[Callable[..., Any]]]
-    tw_client: tweepy.Client
-    tw_api_V1: tweepy.API
     data: Dict[Any, Any]
 
     def __init__(self) -> None:
         """
         Initialize the client.
 
-        The twitter client is initialized with the credentials from the environment variables
-        API_KEY, API_SECRET, ACCESS_TOKEN, and ACCESS_SECRET. If any of these variables
-        are not set, the client will not be able to perform any actions.
+        The client is initialized with an empty dictionary of listeners, and an empty
+        dictionary of data. Nothing else is done here to keep the startup cheap:
 
-        The client is also initialized with an empty dictionary
-        of listeners, and an empty dictionary of data.
+        - the twitter clients are built on first access of tw_client or tw_api_V1, with the
+          credentials from the environment variables API_KEY, API_SECRET, ACCESS_TOKEN, and
+          ACCESS_SECRET. Assigning them beforehand (e.g. with a MockedTwitter) means the real
+          clients are never built.
+        - the coordinator shared with the other replicas is opened on first access, from the
+          COORDINATION_DB environment variable, defaulting to data/coordination.db.
+        - the vote matrix of this replica is opened on first access, in a directory named
+          after the worker id under the VOTE_MATRIX_DIR environment variable, defaulting to
+          data/votes. VoteMatrix.merged combines the matrices of every replica.
+        - the JSON state files are read on first access of the data.
 
         Its recommended to not instanciate yourself a client and use the instance()
         function instead to be able to reuse the same client and attach listeners.
         """
+        self.listeners = {}
+        self.data = {}
+
+        self._tw_client: Optional[tweepy.Client] = None
+        self._tw_api_V1: Optional[tweepy.API] = None
+        self._coordinator: Optional[Coordinator] = None
+        self._vote_matrix: Optional[VoteMatrix] = None
+        self._data_loaded = False
+
+    @property
+    def tw_client(self) -> tweepy.Client:
+        if self._tw_client is None:
+            self._build_twitter()
+        return self._tw_client
+
+    @tw_client.setter
+    def tw_client(self, value: tweepy.Client) -> None:
+        self._tw_client = value
+
+    @property
+    def tw_api_V1(self) -> tweepy.API:
+        if self._tw_api_V1 is None:
+            self._build_twitter()
+        return self._tw_api_V1
+
+    @tw_api_V1.setter
+    def tw_api_V1(self, value: tweepy.API) -> None:
+        self._tw_api_V1 = value
+
+    @property
+    def coordinator(self) -> Coordinator:
+        if self._coordinator is None:
+            self._coordinator = SQLiteCoordinator(os.getenv("COORDINATION_DB", "data/coordination.db"))
+            logger.debug(f"Worker id: {self._coordinator.worker_id}")
+        return self._coordinator
+
+    @coordinator.setter
+    def coordinator(self, value: Coordinator) -> None:
+        self._coordinator = value
+
+    @property
+    def vote_matrix(self) -> VoteMatrix:
+        if self._vote_matrix is None:
+            from .vote_matrix import VoteMatrix
+
+            path = os.path.join(os.getenv("VOTE_MATRIX_DIR", "data/votes"), self.coordinator.worker_id)
+            self._vote_matrix = VoteMatrix(path)
+        return self._vote_matrix
+
+    def _build_twitter(self) -> None:
+        """
+        Build the twitter clients that have not been assigned yet.
+
+        :raises ValueError: If the twitter API credentials are not set.
+        """
+        import tweepy
+
         api_key = os.getenv("API_KEY")
         api_secret = os.getenv("API_SECRET")
         access_token = os.getenv("ACCESS_TOKEN")
@@ -78,38 +144,44 @@ class Client:
         logger.debug(f"ACCESS_TOKEN: {anon_key(access_token)}")
         logger.debug(f"ACCESS_SECRET: {anon_key(access_secret)}")
 
-        self.tw_client = tweepy.Client(
-            consumer_key=api_key,
-            consumer_secret=api_secret,
-            access_token=access_token,
-            access_token_secret=access_secret,
-            wait_on_rate_limit=True,
-        )
-        self.tw_api_V1 = tweepy.API(
-            tweepy.OAuth1UserHandler(
+        if self._tw_client is None:
+            self._tw_client = tweepy.Client(
                 consumer_key=api_key,
                 consumer_secret=api_secret,
                 access_token=access_token,
                 access_token_secret=access_secret,
+                wait_on_rate_limit=True,
+            )
+        if self._tw_api_V1 is None:
+            self._tw_api_V1 = tweepy.API(
+                tweepy.OAuth1UserHandler(
+                    consumer_key=api_key,
+                    consumer_secret=api_secret,
+                    access_token=access_token,
+                    access_token_secret=access_secret,
+                )
             )
-        )
-        self.listeners = {}
-        self.data = {}
-
-        self._load_data()
 
     def _load_data(self) -> None:
+        if self._data_loaded:
+            return
+        self._data_loaded = True
+
         # ? posted scrutin is a json formated like
         # ? { "<scrutin_id>": "<media_id>", ???? }
         with open("data/linked_media.json", "r") as f:
             data = json.load(f)
-            self.add_data("linked_media", data)
+            self.data.setdefault("linked_media", data)
 
         with open("data/posted_scrutins.json", "r") as f:
             data = json.load(f)
-            self.add_data("posted_scrutins", data["id"])
+            self.data.setdefault("posted_scrutins", data["id"])
 
     async def save_data(self) -> None:
+        import aiofiles
+
+        self._load_data()
+
         async with aiofiles.open("data/posted_scrutins.json", "w") as f:
             await f.write(json.dumps({"id": self.get_data("posted_scrutins")}))
 
@@ -124,6 +196,7 @@ class Client:
         :param value: The value to be set.
         :return: None
         """
+        self._load_data()
         self.data[key] = value
 
     def remove_data(self, key: Any) -> None:
@@ -133,6 +206,7 @@ class Client:
         :param key: The key to be removed.
         :return: None
         """
+        self._load_data()
         self.data.pop(key, None)
 
     def get_data(self, key: Any) -> Optional[Any]:
@@ -142,6 +216,7 @@ class Client:
         :param key: The key to retrieve the value for.
         :return: The value associated with the key, or None if the key is not found.
         """
+        self._load_data()
         return self.data.get(key, None)
 
     def add_listener(
@@ -196,7 +271,7 @@ class Client:
         :param args: Arguments to be passed to the listeners.
         :param kwargs: Keyword arguments to be passed to the listeners.
         """
-        logger.debug(f"Dispatching event {event}")
+        logger.debug("Dispatching event {}", event)
         event = "on_" + event if not event.startswith("on_") else event
 
         listeners = self.listeners.get(event, [])
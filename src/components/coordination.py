@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from loguru import logger
+
+# ? the stages a scrutin goes through before being committed, in order
+STAGES = ("fetched", "rendered", "uploaded", "tweeted", "replied")
+
+
+def reached(stage: Optional[str], target: str) -> bool:
+    """
+    Check if a scrutin checkpointed at `stage` has completed the `target` stage.
+
+    :param stage: The last completed stage, None if no stage was completed.
+    :param target: The stage to check.
+    :return: True if `target` is already completed.
+    """
+    return stage is not None and STAGES.index(stage) >= STAGES.index(target)
+
+
+def default_worker_id() -> str:
+    """
+    Build the identifier used by this process when holding leases and claims.
+
+    The WORKER_ID environment variable takes precedence, otherwise the id is built from
+    the hostname and the pid so two processes never share the same identity. A WORKER_ID
+    must be unique among the running processes too.
+
+    :return: The worker identifier.
+    """
+    return os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class ClaimLost(Exception):
+    """
+    Raised when a worker acts on a scrutin whose claim it no longer holds, because the
+    claim expired and another worker took it over.
+    """
+
+
+class Coordinator(ABC):
+    """
+    Coordination backend shared by every replica of the bot.
+
+    It provides a lease based leader election, used to make sure only one replica polls
+    the scrutins feed, and a claim/commit protocol on scrutins, used to make sure a
+    scrutin is rendered, uploaded and tweeted by exactly one replica.
+    """
+
+    worker_id: str
+
+    @abstractmethod
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        """
+        Acquire or renew the lease `name` for `ttl` seconds.
+
+        :param name: The name of the lease.
+        :param ttl: The lease duration in seconds.
+        :return: True if this worker holds the lease, False otherwise.
+        """
+
+    @abstractmethod
+    def release_lease(self, name: str) -> None:
+        """
+        Release the lease `name` if held by this worker.
+
+        :param name: The name of the lease.
+        """
+
+    @abstractmethod
+    def heartbeat(self) -> None:
+        """
+        Signal that this worker is alive. The claims of a worker that stopped signaling for
+        its liveness ttl are handed to the other workers without waiting for them to
+        expire, so the in-flight scrutins of a crashed or restarted process resume quickly.
+        Claiming a scrutin also signals, this must be called periodically in between.
+        """
+
+    @abstractmethod
+    def offer(self, scrutin_id: int, payload: Dict[str, Any]) -> None:
+        """
+        Make a scrutin available to the workers. A no-op if the scrutin is already known.
+
+        :param scrutin_id: The id of the scrutin.
+        :param payload: The JSON serializable scrutin, handed back by claim_next.
+        """
+
+    @abstractmethod
+    def claim_next(self, ttl: float) -> Optional[Dict[str, Any]]:
+        """
+        Claim the oldest scrutin not yet committed nor claimed by a live worker, a claim is
+        taken over once expired or once its owner stopped sending heartbeats. Scrutins with a
+        checkpoint are claimed first to finish in-flight work before starting new one.
+
+        :param ttl: The claim duration in seconds, after which another worker may take it over.
+        :return: The payload of the claimed scrutin, or None if there is nothing to claim.
+        """
+
+    @abstractmethod
+    def renew(self, scrutin_id: int) -> None:
+        """
+        Check that this worker still holds the claim on a scrutin and push its expiry
+        forward by the ttl it was claimed with. Must be called right before any action
+        that cannot be undone, like tweeting.
+
+        :param scrutin_id: The id of the scrutin.
+        :raises ClaimLost: If the claim is held by another worker.
+        """
+
+    @abstractmethod
+    def checkpoint(self, scrutin_id: int, stage: str, artifacts: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Durably record that a claimed scrutin completed `stage`, renewing the claim.
+        Checkpointing an earlier stage rewinds the scrutin, to redo the stages after it.
+
+        :param scrutin_id: The id of the scrutin.
+        :param stage: One of STAGES.
+        :param artifacts: JSON serializable references produced by the stage, merged with
+            the ones of the previous stages.
+        :return: The recorded stage.
+        :raises ClaimLost: If the claim is held by another worker.
+        """
+
+    @abstractmethod
+    def progress(self, scrutin_id: int) -> Tuple[Optional[str], Dict[str, Any]]:
+        """
+        :param scrutin_id: The id of the scrutin.
+        :return: The last completed stage, or None, and the artifacts recorded so far.
+        """
+
+    @abstractmethod
+    def commit(self, scrutin_id: int, result: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Mark a claimed scrutin as posted. A committed scrutin is never claimed again.
+
+        :param scrutin_id: The id of the scrutin.
+        :param result: Optional JSON serializable result (media id, tweet id, ...).
+        :raises ClaimLost: If the claim is held by another worker.
+        """
+
+    @abstractmethod
+    def release(self, scrutin_id: int, failed: bool = False) -> None:
+        """
+        Give back a claimed scrutin so another worker can take it.
+
+        A scrutin released after a failure is claimed again after a backoff doubling with
+        each failed attempt, and is marked dead once it ran out of attempts. A claim
+        taken over after it expired counts as a failed attempt too.
+
+        :param scrutin_id: The id of the scrutin.
+        :param failed: Whether the claim is given back because processing the scrutin
+            failed, otherwise it can be claimed immediately.
+        """
+
+    @abstractmethod
+    def committed(self) -> Set[int]:
+        """
+        :return: The ids of every committed scrutin.
+        """
+
+
+class SQLiteCoordinator(Coordinator):
+    """
+    Coordinator backed by a SQLite database.
+
+    Every replica must open the same database file, so it only fits replicas running
+    on the same host or sharing a local volume. Each operation runs in its own
+    `BEGIN IMMEDIATE` transaction which serializes writers across processes.
+
+    The operations block while another replica holds the write lock, call them from a
+    thread (`asyncio.to_thread`) rather than from the event loop. The connection is
+    shared by those threads, a lock serializes its use within the process.
+
+    The liveness of each worker is a `worker:<worker id>` lease, renewed by heartbeat and
+    by claim_next for `liveness_ttl` seconds.
+
+    A scrutin is attempted `max_attempts` times, the n-th failed attempt delays the next
+    one by `retry_delay * 2 ** (n - 1)` seconds. Dead scrutins are left in the table with
+    the `dead` status.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        worker_id: Optional[str] = None,
+        liveness_ttl: float = 60,
+        max_attempts: int = 5,
+        retry_delay: float = 60,
+    ) -> None:
+        self.path = path
+        self.worker_id = worker_id or default_worker_id()
+        self.liveness_ttl = liveness_ttl
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # ? the ttl of each claim held by this worker, to renew it
+        self._claim_ttls: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS scrutins (
+                id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                expires_at REAL,
+                result TEXT,
+                stage TEXT,
+                artifacts TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                retry_at REAL
+            );
+            """
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(scrutins)")}
+        for column, definition in (
+            ("stage", "TEXT"),
+            ("artifacts", "TEXT"),
+            ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+            ("retry_at", "REAL"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE scrutins ADD COLUMN {column} {definition}")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _acquire_lease(self, conn: sqlite3.Connection, name: str, ttl: float) -> bool:
+        now = time.time()
+        conn.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """,
+            (name, self.worker_id, now + ttl, now),
+        )
+        row = conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == self.worker_id
+
+    def acquire_lease(self, name: str, ttl: float) -> bool:
+        with self._transaction() as conn:
+            return self._acquire_lease(conn, name, ttl)
+
+    def release_lease(self, name: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, self.worker_id))
+
+    def heartbeat(self) -> None:
+        with self._transaction() as conn:
+            self._acquire_lease(conn, f"worker:{self.worker_id}", self.liveness_ttl)
+
+    def offer(self, scrutin_id: int, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO scrutins (id, payload) VALUES (?, ?)",
+                (scrutin_id, json.dumps(payload)),
+            )
+
+    def claim_next(self, ttl: float) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._transaction() as conn:
+            # ? a worker must be alive before claiming, so its claim is not taken over at once
+            self._acquire_lease(conn, f"worker:{self.worker_id}", self.liveness_ttl)
+            while True:
+                row = conn.execute(
+                    """
+                    SELECT id, payload, status, attempts FROM scrutins
+                    WHERE (status = 'pending' AND COALESCE(retry_at, 0) <= ?)
+                    OR (status = 'claimed' AND (expires_at < ? OR NOT EXISTS (
+                        SELECT 1 FROM leases WHERE name = 'worker:' || scrutins.owner AND expires_at >= ?
+                    )))
+                    ORDER BY stage IS NULL, id LIMIT 1
+                    """,
+                    (now, now, now),
+                ).fetchone()
+                if row is None or row[2] == "pending" or row[3] < self.max_attempts:
+                    break
+                # ? the owner of the last attempt died or let the claim expire, after a failure
+                # ? once the tweet request was out
+                self._fail(conn, row[0], row[3])
+
+            if row is not None:
+                conn.execute(
+                    """
+                    UPDATE scrutins SET status = 'claimed', owner = ?, expires_at = ?, retry_at = NULL,
+                    attempts = attempts + 1 WHERE id = ?
+                    """,
+                    (self.worker_id, now + ttl, row[0]),
+                )
+
+        if row is None:
+            return None
+        self._claim_ttls[row[0]] = ttl
+        return json.loads(row[1])
+
+    def _fail(self, conn: sqlite3.Connection, scrutin_id: int, attempts: int) -> None:
+        if attempts >= self.max_attempts:
+            logger.warning(f"Scrutin {scrutin_id} failed {attempts} times, giving up")
+            conn.execute(
+                "UPDATE scrutins SET status = 'dead', owner = NULL, expires_at = NULL WHERE id = ?", (scrutin_id,)
+            )
+            return
+
+        conn.execute(
+            "UPDATE scrutins SET status = 'pending', owner = NULL, expires_at = NULL, retry_at = ? WHERE id = ?",
+            (time.time() + self.retry_delay * 2 ** (attempts - 1), scrutin_id),
+        )
+
+    def _renew(self, conn: sqlite3.Connection, scrutin_id: int) -> None:
+        cursor = conn.execute(
+            """
+            UPDATE scrutins SET expires_at = COALESCE(?, expires_at)
+            WHERE id = ? AND owner = ? AND status = 'claimed'
+            """,
+            (time.time() + ttl if (ttl := self._claim_ttls.get(scrutin_id)) else None, scrutin_id, self.worker_id),
+        )
+        if cursor.rowcount == 0:
+            raise ClaimLost(f"Claim on scrutin {scrutin_id} is no longer held by {self.worker_id}")
+
+    def renew(self, scrutin_id: int) -> None:
+        with self._transaction() as conn:
+            self._renew(conn, scrutin_id)
+
+    def checkpoint(self, scrutin_id: int, stage: str, artifacts: Optional[Dict[str, Any]] = None) -> str:
+        assert stage in STAGES, f"Unknown stage {stage}"
+
+        with self._transaction() as conn:
+            self._renew(conn, scrutin_id)
+            row = conn.execute("SELECT artifacts FROM scrutins WHERE id = ?", (scrutin_id,)).fetchone()
+            merged = json.loads(row[0]) if row and row[0] else {}
+            merged.update(artifacts or {})
+            conn.execute(
+                "UPDATE scrutins SET stage = ?, artifacts = ? WHERE id = ? AND owner = ?",
+                (stage, json.dumps(merged), scrutin_id, self.worker_id),
+            )
+        return stage
+
+    def progress(self, scrutin_id: int) -> Tuple[Optional[str], Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT stage, artifacts FROM scrutins WHERE id = ?", (scrutin_id,)).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1]) if row[1] else {}
+
+    def commit(self, scrutin_id: int, result: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                UPDATE scrutins SET status = 'committed', expires_at = NULL, result = ?
+                WHERE id = ? AND owner = ? AND status = 'claimed'
+                """,
+                (json.dumps(result) if result is not None else None, scrutin_id, self.worker_id),
+            )
+        self._claim_ttls.pop(scrutin_id, None)
+        if cursor.rowcount == 0:
+            raise ClaimLost(f"Claim on scrutin {scrutin_id} is no longer held by {self.worker_id}")
+
+    def release(self, scrutin_id: int, failed: bool = False) -> None:
+        self._claim_ttls.pop(scrutin_id, None)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts FROM scrutins WHERE id = ? AND owner = ? AND status = 'claimed'",
+                (scrutin_id, self.worker_id),
+            ).fetchone()
+            if row is None:
+                return
+            if failed:
+                self._fail(conn, scrutin_id, row[0])
+                return
+
+            # ? the attempt is given back, the scrutin was not processed
+            conn.execute(
+                """
+                UPDATE scrutins SET status = 'pending', owner = NULL, expires_at = NULL,
+                attempts = MAX(attempts - 1, 0) WHERE id = ?
+                """,
+                (scrutin_id,),
+            )
+
+    def committed(self) -> Set[int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM scrutins WHERE status = 'committed'").fetchall()
+        return {row[0] for row in rows}
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from loguru import logger
+
+DEBUG_LEVEL = logger.level("DEBUG").no
+
+
+def parse_sampling_env(value: str) -> Dict[str, float]:
+    """
+    Parse the LOG_SAMPLING environment variable, a comma separated list of
+    `<module prefix>=<debug records per second>`, e.g. `src.components.client=1,src.tasks=5`.
+    `*` applies to every module without a more specific entry.
+
+    Malformed entries are logged and ignored.
+
+    :param value: The value of the environment variable.
+    :return: A dict mapping each module prefix to its rate.
+    """
+    rates = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        module, _, rate = entry.partition("=")
+        try:
+            parsed = float(rate)
+        except ValueError:
+            parsed = -1
+        if not module.strip() or parsed < 0:
+            logger.warning(f"Ignoring malformed LOG_SAMPLING entry {entry!r}")
+            continue
+        rates[module.strip()] = parsed
+    return rates
+
+
+class DebugSampler:
+    """
+    Loguru filter limiting the debug records of hot paths.
+
+    Each call site (module, function, line) of a sampled module may emit at most `rate`
+    debug records per second, the others are dropped. The next record emitted by the call
+    site carries the number of dropped ones in its `sampled_out` extra. Records above
+    DEBUG are never sampled.
+    """
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        """
+        :param rates: The rates per module prefix, see parse_sampling_env.
+        """
+        self.rates = rates
+        self._windows: Dict[Tuple[str, str, int], Tuple[float, int, int]] = {}
+        self._module_rates: Dict[str, Optional[float]] = {}
+
+    def _rate(self, module: str) -> Optional[float]:
+        if module not in self._module_rates:
+            prefixes = [prefix for prefix in self.rates if module == prefix or module.startswith(prefix + ".")]
+            best = max(prefixes, key=len, default="*")
+            self._module_rates[module] = self.rates.get(best)
+        return self._module_rates[module]
+
+    def __call__(self, record: Dict[str, Any]) -> bool:
+        if record["level"].no > DEBUG_LEVEL:
+            return True
+
+        rate = self._rate(record["name"] or "")
+        if rate is None:
+            return True
+
+        site = (record["name"], record["function"], record["line"])
+        now = time.monotonic()
+        started, emitted, dropped = self._windows.get(site, (now, 0, 0))
+        if now - started >= 1:
+            started, emitted = now, 0
+
+        if emitted >= rate:
+            self._windows[site] = (started, emitted, dropped + 1)
+            return False
+
+        if dropped:
+            record["extra"]["sampled_out"] = dropped
+        self._windows[site] = (started, emitted + 1, 0)
+        return True
+
+
+def setup() -> None:
+    """
+    Replace the default loguru sink by a stderr sink written from a background thread, so
+    logging never blocks the event loop.
+
+    Configured by the environment variables LOG_LEVEL (DEBUG by default), LOG_JSON (emit one
+    JSON record per line, with the bound extras such as scrutin_id, stage and duration,
+    when set to 1/true) and LOG_SAMPLING (see parse_sampling_env).
+    """
+    # ? parsed before removing the default sink, which still shows the malformed entries
+    sampler = DebugSampler(parse_sampling_env(os.getenv("LOG_SAMPLING", "")))
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        level=os.getenv("LOG_LEVEL", "DEBUG"),
+        serialize=os.getenv("LOG_JSON", "").lower() in ("1", "true"),
+        filter=sampler,
+        enqueue=True,
+        backtrace=False,
+        diagnose=False,
+    )
+
+
+@contextlib.contextmanager
+def stage(scrutin_id: int, name: str) -> Iterator[None]:
+    """
+    Log the duration of a posting stage as a structured record. A stage interrupted by an
+    exception is logged as a warning with the `failed` extra set.
+
+    :param scrutin_id: The id of the scrutin.
+    :param name: The name of the stage.
+    """
+    started = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        duration = time.perf_counter() - started
+        record = logger.bind(scrutin_id=scrutin_id, stage=name, duration=round(duration, 3), failed=failed)
+        if failed:
+            record.warning(f"Scrutin {scrutin_id} {name} failed after {duration:.3f}s")
+        else:
+            record.info(f"Scrutin {scrutin_id} {name} in {duration:.3f}s")
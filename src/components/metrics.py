@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import threading
+from typing import Dict, Tuple
+
+from loguru import logger
+
+from . import task
+
+# ? a metric is identified by its name and its sorted labels, like prometheus series
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_values: Dict[_Key, float] = {}
+
+
+def _key(name: str, labels: Dict[str, str]) -> _Key:
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels: str) -> None:
+    """
+    Increment a counter. Safe to call from any thread.
+
+    :param name: The name of the counter.
+    :param value: The increment.
+    :param labels: The labels of the series.
+    """
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels: str) -> None:
+    """
+    Set a gauge. Safe to call from any thread.
+
+    :param name: The name of the gauge.
+    :param value: The new value.
+    :param labels: The labels of the series.
+    """
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def get(name: str, **labels: str) -> float:
+    """
+    :param name: The name of the metric.
+    :param labels: The labels of the series.
+    :return: The current value of the series, 0 if it was never set.
+    """
+    with _lock:
+        return _values.get(_key(name, labels), 0)
+
+
+def snapshot() -> Dict[str, float]:
+    """
+    :return: Every series formatted as `name{label="value"}` mapped to its current value.
+    """
+    with _lock:
+        items = list(_values.items())
+
+    series = {}
+    for (name, labels), value in items:
+        formatted = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+        series[f"{name}{{{formatted}}}" if formatted else name] = value
+    return series
+
+
+@task.loop(minutes=1)
+async def report_metrics() -> None:
+    """
+    Log every series as a `metrics` structured record, the series are bound in the
+    `metrics` extra to be picked up from the JSON logs.
+    """
+    series = snapshot()
+    if not series:
+        return
+
+    formatted = ", ".join(f"{name}={value:g}" for name, value in sorted(series.items()))
+    logger.bind(event="metrics", metrics=series).info(f"Metrics: {formatted}")
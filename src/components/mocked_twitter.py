@@ -1,6 +1,7 @@
 import uuid
 from io import BytesIO
 from pathlib import Path
+from typing import NamedTuple
 
 
 class MockedMedia:
@@ -9,6 +10,13 @@ class MockedMedia:
         self.media_url = media_url
 
 
+class MockedResponse(NamedTuple):
+    data: dict
+    includes: dict = {}
+    errors: list = []
+    meta: dict = {}
+
+
 class MockedTwitter:
     def media_upload(self, filename, *, file: BytesIO = None, chunked=False,
                      media_category=None, additional_owners=None, **kwargs):
@@ -39,6 +47,6 @@ class MockedTwitter:
         in_reply_to_tweet_id=None, reply_settings=None, text=None, \
         user_auth=True)
 
-        Mocked method to simulate tweet creation. Does not perform any action.
+        Mocked method to simulate tweet creation. Returns a response shaped like tweepy's one.
         """
-        return True
+        return MockedResponse(data={"id": str(uuid.uuid4()), "text": text})
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from loguru import logger
+
+TOP_ENTRIES = 30
+
+# ? tracemalloc is shared by the tasks profiled at the same time, stopped by the last one
+_active_profiles = 0
+# ? the TASK_PROFILE runs left to profile by task name, parsed on the first task run
+_remaining_runs: Optional[Dict[str, int]] = None
+# ? numbers the profiles of this process, several can be written in the same second
+_profile_ids = itertools.count(1)
+
+
+def parse_profile_env(value: str) -> Dict[str, int]:
+    """
+    Parse the TASK_PROFILE environment variable, a comma separated list of `<task>[:<runs>]`.
+    `*` matches every task and runs default to 1, e.g. `create_post:3,get_scrutins_task`.
+
+    Malformed entries are logged and ignored.
+
+    :param value: The value of the environment variable.
+    :return: A dict mapping each task name to the number of runs to profile.
+    """
+    runs = {}
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        name, _, count = entry.partition(":")
+        if not name or (count and not count.isdigit()):
+            logger.warning(f"Ignoring malformed TASK_PROFILE entry {entry!r}")
+            continue
+        runs[name] = int(count) if count else 1
+    return runs
+
+
+def take_profiled_run(task_name: str) -> bool:
+    """
+    Consume one of the runs TASK_PROFILE asks to profile for a task. The runs are counted
+    by task name across every Task instance, e.g. the one started by each dispatch, and a
+    `*` entry grants its runs once to each name.
+
+    :param task_name: The name of the task about to run.
+    :return: True if this run must be profiled.
+    """
+    global _remaining_runs
+
+    if _remaining_runs is None:
+        _remaining_runs = parse_profile_env(os.getenv("TASK_PROFILE", ""))
+
+    runs = _remaining_runs.setdefault(task_name, _remaining_runs.get("*", 0))
+    if runs <= 0:
+        return False
+    _remaining_runs[task_name] = runs - 1
+    return True
+
+
+def profile_dir(task_name: str) -> Path:
+    """
+    :param task_name: The name of the profiled task.
+    :return: The directory receiving the profiles of the task, under PROFILE_DIR (default profiles).
+    """
+    path = Path(os.getenv("PROFILE_DIR", "profiles")) / task_name
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+@contextlib.contextmanager
+def profile_run(task_name: str, run: int) -> Iterator[None]:
+    """
+    Profile the CPU time and the allocations of the wrapped block.
+
+    Three files are written in the task directory, prefixed by the timestamp, the pid and
+    a number unique within the process:
+    `.pstats` (loadable with pstats or snakeviz), `.txt` with the top functions by
+    cumulative time, and `.alloc.txt` with the top allocations done during the block.
+
+    The profiler sees everything running on the event loop thread while the block is
+    awaited, not only the profiled task. Only one CPU profiler can be active at a time,
+    a block entered while another one is profiled only records its allocations.
+
+    :param task_name: The name of the profiled task, used as directory name.
+    :param run: The run number of the task.
+    """
+    global _active_profiles
+
+    profiler = cProfile.Profile() if _active_profiles == 0 else None
+    if _active_profiles == 0 and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _active_profiles += 1
+    before = tracemalloc.take_snapshot()
+
+    started = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+        after = tracemalloc.take_snapshot()
+        _active_profiles -= 1
+        if _active_profiles == 0:
+            tracemalloc.stop()
+
+        prefix = profile_dir(task_name) / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_ids)}"
+        if profiler:
+            profiler.dump_stats(f"{prefix}.pstats")
+
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(TOP_ENTRIES)
+            Path(f"{prefix}.txt").write_text(report.getvalue())
+
+        allocations = after.compare_to(before, "lineno")[:TOP_ENTRIES]
+        Path(f"{prefix}.alloc.txt").write_text("\n".join(str(stat) for stat in allocations))
+
+        logger.info(f"Profiled run {run} of {task_name} in {elapsed:.3f}s, written to {prefix}.*")
@@ -2,8 +2,6 @@ from __future__ import annotations
 
 from typing import Any, Dict
 
-import aiohttp
-
 
 async def get(url: str) -> Dict[str, Any]:
     """
@@ -15,6 +13,9 @@ async def get(url: str) -> Dict[str, Any]:
     :return: The JSON object from the response body as a dictionary
     :raises Exception: If the response status is not between 200 and 300
     """
+    # ? aiohttp is slow to import, only pay for it on the first request
+    import aiohttp
+
     async with aiohttp.ClientSession() as session:
         async with session.get(url) as response:
             if not 200 <= response.status < 300:
@@ -4,10 +4,26 @@ import asyncio
 import contextlib
 import inspect
 import random
+import weakref
 from typing import Any, Awaitable, Callable
 
 from loguru import logger
 
+from . import profiling
+
+# ? every started task, to toggle profiling on all of them at once
+_running_tasks: weakref.WeakSet[Task] = weakref.WeakSet()
+
+
+def profile_all(runs: int = 1) -> None:
+    """
+    Profile the next `runs` runs of every started task. Meant to be used as a signal handler.
+
+    :param runs: The number of runs to profile.
+    """
+    for running in list(_running_tasks):
+        running.profile(runs)
+
 
 class Task:
     def __init__(self, callback: Callable[[], Awaitable[None]], delay: float, count: int) -> None:
@@ -23,6 +39,7 @@ class Task:
         self._task: asyncio.Task[None] | None = None
 
         self._internal_count = 1
+        self._profile_runs = 0
 
     def __await__(self):
         """
@@ -49,11 +66,29 @@ class Task:
         """
         if self._task:
             raise RuntimeError("loop is already running")
+
+        _running_tasks.add(self)
         self._task = asyncio.create_task(
             self._run(*args, **kwargs),
             name=f"{self.callback.__name__}-{random.randint(1, 999):03d}",
         )
 
+    @property
+    def last_run(self) -> bool:
+        """
+        :return: True if the current run of the callback is the last one.
+        """
+        return self.count != -1 and self._internal_count >= self.count
+
+    def profile(self, runs: int = 1) -> None:
+        """
+        Profile the next runs of the callback, see profiling.profile_run for the output.
+
+        :param runs: The number of runs to profile.
+        """
+        logger.info(f"Profiling the next {runs} run(s) of {self.callback.__name__}")
+        self._profile_runs = runs
+
     def stop(self):
         """
         Stop the loop.
@@ -61,6 +96,7 @@ class Task:
         This method will stop the loop if it is running. If the loop is not running,
         a no-op is performed.
         """
+        _running_tasks.discard(self)
         if self._task:
             self._task.cancel()
             self._task = None
@@ -78,12 +114,19 @@ class Task:
         :param kwargs: Keyword arguments to be passed to the callback.
         """
         while True:
+            profiler = contextlib.nullcontext()
+            # ? the runs asked by profile are taken first, then the ones of TASK_PROFILE
+            if self._profile_runs > 0 or profiling.take_profiled_run(self.callback.__name__):
+                self._profile_runs = max(self._profile_runs - 1, 0)
+                profiler = profiling.profile_run(self.callback.__name__, self._internal_count)
+
             try:
-                await self.callback(*args, **kwargs)
+                with profiler:
+                    await self.callback(*args, **kwargs)
             except Exception as e:
                 logger.error(f"Task {self._task.get_name()} failed: {e}")
 
-            if self.count != -1 and self._internal_count >= self.count:
+            if self.last_run:
                 break
 
             await asyncio.sleep(self.delay)
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.models import Depute, ScrutinAnalyse
+
+from .artifacts import write_artifact
+
+NO_VOTE = 0
+FOR = 1
+AGAINST = 2
+ABSTENTION = 3
+ABSENT = 4
+
+# ? the positions taken into account for cohesion and broken ranks
+EXPRESSED = (FOR, AGAINST, ABSTENTION)
+
+_POSITIONS = {
+    "vote_for": FOR,
+    "vote_against": AGAINST,
+    "vote_abstention": ABSTENTION,
+    "vote_absent": ABSENT,
+}
+
+
+def _depute_key(depute: Any) -> Tuple[str, str, str]:
+    """
+    The scrutin details are not always structured, accept both Depute and raw dicts.
+
+    :param depute: A Depute or a dict with the same fields.
+    :return: The (first_name, last_name, party) tuple of the depute.
+    """
+    if isinstance(depute, Depute):
+        return depute.first_name, depute.last_name, depute.party
+    return depute["first_name"], depute["last_name"], depute["party"]
+
+
+class VoteMatrix:
+    """
+    Columnar store of every depute vote, a deputes x scrutins matrix of int8 position
+    codes (NO_VOTE, FOR, AGAINST, ABSTENTION, ABSENT) memory-mapped from disk.
+
+    The matrix lives in `<path>/votes.npy` and the row and column labels in
+    `<path>/index.json`. Both grow by doubling when a new depute or scrutin is added.
+    The files are owned by a single process: each worker writes in its own directory
+    and only holds the scrutins it rendered, use `merged` to query all of them at once.
+    Without a path the matrix is kept in memory.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        initial_deputes: int = 1024,
+        initial_scrutins: int = 4096,
+        read_only: bool = False,
+    ) -> None:
+        """
+        :param path: The directory of the matrix, None to keep it in memory.
+        :param initial_deputes: The number of rows allocated for a new matrix.
+        :param initial_scrutins: The number of columns allocated for a new matrix.
+        :param read_only: Open an existing matrix without writing to it.
+        """
+        self.path = Path(path) if path else None
+        self.read_only = read_only
+
+        self.deputes: List[Depute] = []
+        self.scrutins: List[int] = []
+
+        if self.path is None:
+            self._votes = np.zeros((initial_deputes, initial_scrutins), dtype=np.int8)
+        elif self._votes_path.exists() and self._index_path.exists():
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+            self.deputes = [Depute(*depute) for depute in index["deputes"]]
+            self.scrutins = index["scrutins"]
+            self._votes = np.lib.format.open_memmap(self._votes_path, mode="r" if read_only else "r+")
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._votes = np.lib.format.open_memmap(
+                self._votes_path, mode="w+", dtype=np.int8, shape=(initial_deputes, initial_scrutins)
+            )
+
+        self._depute_rows: Dict[Tuple[str, str], int] = {
+            (depute.first_name, depute.last_name): row for row, depute in enumerate(self.deputes)
+        }
+        self._scrutin_cols: Dict[int, int] = {scrutin_id: col for col, scrutin_id in enumerate(self.scrutins)}
+
+    @classmethod
+    def merged(cls, root: str) -> VoteMatrix:
+        """
+        Combine the matrices of every replica, stored in the subdirectories of `root`, in
+        a new in-memory matrix. A scrutin present in several matrices is taken from the
+        last one read.
+
+        :param root: The directory holding one matrix directory per replica.
+        :return: The combined matrix.
+        """
+        matrix = cls()
+        for directory in sorted(Path(root).glob("*/")):
+            if not (directory / "votes.npy").exists():
+                continue
+
+            part = cls(str(directory), read_only=True)
+            for col, scrutin_id in enumerate(part.scrutins):
+                column = part.votes[:, col]
+                rows = np.flatnonzero(column)
+                matrix._record(scrutin_id, [(part.deputes[row], int(column[row])) for row in rows])
+        return matrix
+
+    @property
+    def _votes_path(self) -> Path:
+        return self.path / "votes.npy"
+
+    @property
+    def _index_path(self) -> Path:
+        return self.path / "index.json"
+
+    @property
+    def votes(self) -> np.ndarray:
+        """
+        :return: A view of the filled part of the matrix.
+        """
+        return self._votes[: len(self.deputes), : len(self.scrutins)]
+
+    def _grow(self, deputes: int, scrutins: int) -> None:
+        rows, cols = self._votes.shape
+        if deputes <= rows and scrutins <= cols:
+            return
+
+        while rows < deputes:
+            rows *= 2
+        while cols < scrutins:
+            cols *= 2
+
+        if self.path is None:
+            grown = np.zeros((rows, cols), dtype=np.int8)
+            grown[: self._votes.shape[0], : self._votes.shape[1]] = self._votes
+            self._votes = grown
+            return
+
+        tmp = self.path / "votes.npy.tmp"
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.int8, shape=(rows, cols))
+        grown[: self._votes.shape[0], : self._votes.shape[1]] = self._votes
+        grown.flush()
+        del grown
+        del self._votes
+
+        os.replace(tmp, self._votes_path)
+        self._votes = np.lib.format.open_memmap(self._votes_path, mode="r+")
+
+    def _row(self, depute: Any) -> int:
+        first_name, last_name, party = _depute_key(depute)
+        row = self._depute_rows.get((first_name, last_name))
+        if row is None:
+            row = len(self.deputes)
+            self._depute_rows[(first_name, last_name)] = row
+            self.deputes.append(Depute(first_name, last_name, party))
+        elif self.deputes[row].party != party:
+            # ? keep the latest known party of the depute
+            self.deputes[row] = Depute(first_name, last_name, party)
+        return row
+
+    def add(self, scrutin_analyse: ScrutinAnalyse) -> None:
+        """
+        Record the votes of a scrutin. Adding the same scrutin again overwrites its column.
+
+        :param scrutin_analyse: The details of the scrutin.
+        """
+        positions = [
+            (depute, code) for field, code in _POSITIONS.items() for depute in getattr(scrutin_analyse, field) or []
+        ]
+        self._record(scrutin_analyse.id, positions)
+        self.flush()
+
+    def _record(self, scrutin_id: int, positions: List[Tuple[Any, int]]) -> None:
+        assert not self.read_only, "The vote matrix is opened read only"
+
+        positions = [(self._row(depute), code) for depute, code in positions]
+
+        col = self._scrutin_cols.get(scrutin_id)
+        if col is None:
+            col = len(self.scrutins)
+            self._scrutin_cols[scrutin_id] = col
+            self.scrutins.append(scrutin_id)
+
+        self._grow(len(self.deputes), len(self.scrutins))
+
+        column = np.zeros(self._votes.shape[0], dtype=np.int8)
+        if positions:
+            rows, codes = zip(*positions)
+            column[list(rows)] = codes
+        self._votes[:, col] = column
+
+    def flush(self) -> None:
+        """
+        Write the matrix and its labels to disk. A no-op for an in-memory matrix.
+        """
+        if self.path is None:
+            return
+
+        self._votes.flush()
+        index = {
+            "deputes": [[d.first_name, d.last_name, d.party] for d in self.deputes],
+            "scrutins": self.scrutins,
+        }
+        write_artifact(str(self._index_path), json.dumps(index).encode())
+
+    def _party_rows(self, party: str) -> np.ndarray:
+        return np.array([row for row, depute in enumerate(self.deputes) if depute.party == party], dtype=np.intp)
+
+    def _column(self, scrutin_id: int) -> np.ndarray:
+        col = self._scrutin_cols.get(scrutin_id)
+        if col is None:
+            raise KeyError(f"Scrutin {scrutin_id} is not in the vote matrix")
+        return self.votes[:, col]
+
+    def party_breakdown(self, scrutin_id: int) -> Dict[str, Dict[str, int]]:
+        """
+        Count the positions of every party on a scrutin.
+
+        :param scrutin_id: The id of the scrutin.
+        :return: A dict mapping each party to its count of for, against, abstention and absent.
+        :raises KeyError: If the scrutin is not in the matrix.
+        """
+        column = self._column(scrutin_id)
+        parties = np.array([depute.party for depute in self.deputes])
+
+        breakdown = {}
+        for party in np.unique(parties[column != NO_VOTE]):
+            counts = np.bincount(column[parties == party], minlength=ABSENT + 1)
+            breakdown[str(party)] = {field[5:]: int(counts[code]) for field, code in _POSITIONS.items()}
+        return breakdown
+
+    def party_cohesion(self, party: str, scrutin_id: Optional[int] = None) -> float:
+        """
+        Share of the expressed votes of a party following its majority position, averaged
+        over every scrutin where the party expressed itself, or on a single scrutin.
+
+        :param party: The party.
+        :param scrutin_id: Restrict the cohesion to this scrutin.
+        :return: The cohesion between 0 and 1, NaN if the party never expressed itself.
+        """
+        sub = self.votes[self._party_rows(party)]
+        if scrutin_id is not None:
+            sub = self._column(scrutin_id)[self._party_rows(party)][:, None]
+
+        counts = np.stack([(sub == code).sum(axis=0) for code in EXPRESSED])
+        expressed = counts.sum(axis=0)
+        mask = expressed > 0
+        if not mask.any():
+            return float("nan")
+        return float((counts.max(axis=0)[mask] / expressed[mask]).mean())
+
+    def participation(self, first_name: str, last_name: str) -> float:
+        """
+        Share of the recorded scrutins where a depute expressed a vote.
+
+        :param first_name: The first name of the depute.
+        :param last_name: The last name of the depute.
+        :return: The participation rate between 0 and 1, NaN if no scrutin was recorded.
+        :raises KeyError: If the depute is not in the matrix.
+        """
+        row = self.votes[self._depute_rows[(first_name, last_name)]]
+        recorded = row != NO_VOTE
+        if not recorded.any():
+            return float("nan")
+        return float(np.isin(row[recorded], EXPRESSED).mean())
+
+    def broke_ranks(self, scrutin_id: int) -> List[Depute]:
+        """
+        List the deputes whose expressed vote differs from the majority of their party.
+
+        :param scrutin_id: The id of the scrutin.
+        :return: The deputes who broke ranks.
+        :raises KeyError: If the scrutin is not in the matrix.
+        """
+        column = self._column(scrutin_id)
+        party_names, party_idx = np.unique([depute.party for depute in self.deputes], return_inverse=True)
+
+        expressed = np.isin(column, EXPRESSED)
+        counts = np.zeros((len(party_names), ABSTENTION + 1), dtype=np.int64)
+        np.add.at(counts, (party_idx[expressed], column[expressed]), 1)
+        majority = counts.argmax(axis=1)
+
+        broke = expressed & (column != majority[party_idx])
+        return [self.deputes[row] for row in np.flatnonzero(broke)]
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from loguru import logger
+
+from . import metrics
+
+
+class LoopWatchdog:
+    """
+    Measure the scheduling lag of the event loop and report what blocks it.
+
+    A heartbeat coroutine sleeps for `interval` seconds and records how late it wakes up
+    in the `event_loop_lag_seconds` gauge. A daemon thread checks the heartbeat: when the
+    loop has not run for more than `threshold` seconds, it captures the stack of the loop
+    thread and the name of the running asyncio task, increments
+    `event_loop_stalls_total{task=...}` and logs a `loop_stall` event. Each stall is
+    reported once, while it is happening, so the stack points at the blocking code.
+    """
+
+    def __init__(self, interval: Optional[float] = None, threshold: Optional[float] = None) -> None:
+        """
+        :param interval: Heartbeat period in seconds, LOOP_LAG_INTERVAL or 0.1 by default.
+        :param threshold: Lag in seconds over which a stall is reported, LOOP_LAG_THRESHOLD
+            or 0.25 by default.
+        """
+        self.interval = interval or float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+        self.threshold = threshold or float(os.getenv("LOOP_LAG_THRESHOLD", "0.25"))
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+        self._reported_heartbeat: Optional[float] = None
+        self._task: Optional[asyncio.Task[None]] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """
+        Start the watchdog on the running event loop.
+
+        :raise RuntimeError: If the watchdog is already running.
+        """
+        if self._task:
+            raise RuntimeError("watchdog is already running")
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+
+        self._task = asyncio.create_task(self._beat(), name="loop-watchdog")
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        """
+        Stop the watchdog. A no-op if it is not running.
+        """
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+
+            lag = max(0.0, now - expected)
+            metrics.set_gauge("event_loop_lag_seconds", lag)
+            if lag > metrics.get("event_loop_max_lag_seconds"):
+                metrics.set_gauge("event_loop_max_lag_seconds", lag)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled <= self.threshold or heartbeat == self._reported_heartbeat:
+                continue
+
+            # ? report once per stall, the heartbeat changes when the loop runs again
+            self._reported_heartbeat = heartbeat
+            self._report(stalled)
+
+    def _report(self, stalled: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+
+        current = asyncio.current_task(self._loop)
+        task_name = current.get_name() if current else "<no task>"
+
+        metrics.inc("event_loop_stalls_total", task=task_name)
+        logger.bind(event="loop_stall", task=task_name, lag=round(stalled, 3), stack=stack).warning(
+            f"Event loop blocked for {stalled:.3f}s by task {task_name}\n{stack}"
+        )
@@ -1,27 +1,43 @@
 from __future__ import annotations
 
+import asyncio
 import base64
+import json
+import os
 import re
+import time
+from dataclasses import asdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from io import BytesIO
 from textwrap import wrap
-from typing import List
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
 from loguru import logger
-from PIL import Image, ImageDraw, ImageFont
 
-from src.components import client, req, task
+from src.components import client, logs, req, task
+from src.components.artifacts import (
+    artifact_path,
+    read_artifact,
+    remove_artifacts,
+    write_artifact,
+)
+from src.components.coordination import ClaimLost, reached
 from src.models import Scrutin, ScrutinAnalyse
 
+if TYPE_CHECKING:
+    from PIL import ImageDraw, ImageFont
+
 CLEAN_TITLE_PATTERN = re.compile(
     r"Scrutin public n.?°\d+\s+sur\s+(l[’']|le|la)\s*", re.IGNORECASE)
 
 CLEAN_PARENTHESIS = re.compile(r"\s*\([^)]*\)", re.IGNORECASE)
 
-FONT_TITLE = ImageFont.truetype("assets/JunePro-Medium.ttf", 52)
-FONT_TEXT = ImageFont.truetype("assets/JunePro-Regular.ttf", 47)
-FONT_TEXT_SMALLER = ImageFont.truetype("assets/JunePro-Regular.ttf", 32)
-FONT_NUMBERS = ImageFont.truetype("assets/JunePro-Extrabold.ttf", 55)
+# ? fonts are loaded on first render, see load_font
+FONT_TITLE = ("assets/JunePro-Medium.ttf", 52)
+FONT_TEXT = ("assets/JunePro-Regular.ttf", 47)
+FONT_TEXT_SMALLER = ("assets/JunePro-Regular.ttf", 32)
+FONT_NUMBERS = ("assets/JunePro-Extrabold.ttf", 55)
 
 
 BASE_URL: str = "https://dysta.github.io/ANDataParser/data"
@@ -31,13 +47,37 @@ AN_BASE_URL: str = "https://www.assemblee-nationale.fr"
 
 MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB = 5_242_880 octets
 
+# ? only the replica holding this lease polls the feed, the others only post. The lease
+# ? is renewed on each poll and outlives a few missed polls before another replica takes over
+POLL_LEASE = "poll_scrutins"
+POLL_LEASE_TTL = 5 * 60
+# ? a claimed scrutin not committed after this delay is handed to another replica. It must
+# ? outlast a tweepy rate limit wait (up to 15 minutes) after the claim is renewed
+CLAIM_TTL = 20 * 60
+# ? twitter drops an uploaded media not attached to a tweet after 24 hours
+MEDIA_TTL = 23 * 60 * 60
+
 bot = client.instance()
 
 
-@task.loop(seconds=1, count=1)
+@task.loop(seconds=20)
+async def send_heartbeat(client: client.Client) -> None:
+    """
+    Keep this worker alive in the coordinator, its claims are taken over by the other
+    replicas once it stops. Sent at a third of the default liveness ttl to survive a
+    missed beat.
+    """
+    await asyncio.to_thread(client.coordinator.heartbeat)
+
+
+@task.loop(minutes=2)
 async def get_scrutins_task(client: client.Client) -> None:
     logger.debug("Running scrutins loop")
 
+    if not await asyncio.to_thread(client.coordinator.acquire_lease, POLL_LEASE, POLL_LEASE_TTL):
+        logger.debug("Another replica holds the poll lease, skipping")
+        return
+
     scrutins_json = await req.get(SCRUTIN_URL)
 
     today = datetime.now()
@@ -53,12 +93,14 @@ async def get_scrutins_task(client: client.Client) -> None:
                     for scrut in scrutins_json["scrutins"][:50]]
 
     linked_media = client.get_data("linked_media")
-    posted_scrutins = client.get_data("posted_scrutins")
+    posted_scrutins = set(client.get_data("posted_scrutins")) | await asyncio.to_thread(client.coordinator.committed)
     for scrutin in scrutins:
         scrutin.posted = scrutin.id in posted_scrutins
         # ? must convert in str to get the key
         if media := linked_media.get(str(scrutin.id)):
             scrutin.media_id = media
+        if not scrutin.posted:
+            await asyncio.to_thread(client.coordinator.offer, scrutin.id, asdict(scrutin))
 
     client.add_data("scrutins", scrutins)
     client.add_data("scrutins_count", len(scrutins))
@@ -70,31 +112,242 @@ async def get_scrutins_task(client: client.Client) -> None:
 async def create_post(client: client.Client) -> None:
     logger.debug("Running post scrutins loop")
 
-    assert client.get_data("scrutins"), "No scrutins to post"
+    # ? the next scrutin is rendered and uploaded while the current thread is published
+    pending = client.get_data("next_post") or asyncio.create_task(prepare_post(client))
+    client.remove_data("next_post")
 
-    ready_to_post = [scrutin for scrutin in client.get_data(
-        "scrutins") if not scrutin.posted]
+    scrutin_to_post = await pending
+    if scrutin_to_post is None:
+        logger.debug("No scrutin to post")
+        return
 
-    scrutin_to_post = ready_to_post.pop()
+    if not create_post.last_run:
+        client.add_data("next_post", asyncio.create_task(prepare_post(client)))
 
-    scrutin_analyse = await get_scrutin_details(scrutin_to_post)
+    await publish_thread(client, scrutin_to_post)
 
-    tweet_image = generate_vote_image(scrutin_to_post, scrutin_analyse)
-    img = client.tw_api_V1.media_upload(
-        filename=tweet_image.name, file=tweet_image)
-    scrutin_to_post.media_id = img.media_id
+    scrutin_to_post.posted = True
+    client.get_data("posted_scrutins").append(scrutin_to_post.id)
+    client.get_data("linked_media")[str(scrutin_to_post.id)] = scrutin_to_post.media_id
+    client.dispatch("scrutins_updated")
 
-    txt = short_tweet(scrutin_to_post)
-    txt2 = tweet_reply(scrutin_to_post)
 
-    assert len(txt) <= 280, f"Tweet too long for scrutin {scrutin_to_post.id}"
+async def prepare_post(client: client.Client) -> Optional[Scrutin]:
+    """
+    Claim the next scrutin to post, fetch its details, render its image and upload it.
 
-    client.tw_client.create_tweet(
-        media_ids=[scrutin_to_post.media_id] if scrutin_to_post.media_id else None)
+    Each stage is checkpointed in the coordinator with the artifact it produced, so a
+    scrutin claimed after a crash resumes from its last completed stage, or an earlier
+    one if its artifacts are lost or expired, see resume_stage. The rendering and the
+    upload are run in a thread to let the event loop publish the previous thread
+    meanwhile. The claim is released if anything fails, as a failed attempt.
 
-    scrutin_to_post.posted = True
-    client.get_data("posted_scrutins").append(scrutin_to_post.id)
-    client.dispatch("scrutins_updated")
+    :param client: The client used to claim the scrutin and upload the media.
+    :return: The claimed scrutin with its media_id set, or None if there is nothing to post.
+    """
+    claimed = await asyncio.to_thread(client.coordinator.claim_next, CLAIM_TTL)
+    if claimed is None:
+        return None
+
+    scrutin = Scrutin(**claimed)
+    stage, artifacts = await asyncio.to_thread(client.coordinator.progress, scrutin.id)
+
+    try:
+        stage = await asyncio.to_thread(resume_stage, stage, artifacts)
+        if stage:
+            logger.info(f"Resuming scrutin {scrutin.id} after stage {stage}")
+
+        scrutin_analyse = None
+        if not reached(stage, "fetched"):
+            with logs.stage(scrutin.id, "fetched"):
+                scrutin_analyse = await get_scrutin_details(scrutin)
+                details = artifact_path(scrutin.id, ".json")
+                await asyncio.to_thread(write_artifact, details, json.dumps(asdict(scrutin_analyse)).encode())
+                stage = await asyncio.to_thread(
+                    client.coordinator.checkpoint, scrutin.id, "fetched", {"details": details}
+                )
+                artifacts["details"] = details
+
+        if not reached(stage, "rendered"):
+            with logs.stage(scrutin.id, "rendered"):
+                if scrutin_analyse is None:
+                    details = await asyncio.to_thread(read_artifact, artifacts["details"])
+                    scrutin_analyse = ScrutinAnalyse(**json.loads(details))
+
+                # ? adding the same scrutin again only overwrites its column
+                await asyncio.to_thread(client.vote_matrix.add, scrutin_analyse)
+
+                tweet_image = await asyncio.to_thread(generate_vote_image, scrutin, scrutin_analyse)
+                image = artifact_path(scrutin.id, ".jpg")
+                await asyncio.to_thread(write_artifact, image, tweet_image.getvalue())
+                stage = await asyncio.to_thread(
+                    client.coordinator.checkpoint, scrutin.id, "rendered", {"image": image}
+                )
+                artifacts["image"] = image
+
+        if not reached(stage, "uploaded"):
+            with logs.stage(scrutin.id, "uploaded"):
+                tweet_image = BytesIO(await asyncio.to_thread(read_artifact, artifacts["image"]))
+                tweet_image.name = f"scrutin_{scrutin.id}.jpg"
+                img = await asyncio.to_thread(
+                    client.tw_api_V1.media_upload, filename=tweet_image.name, file=tweet_image)
+                uploaded = {"media_id": img.media_id, "uploaded_at": time.time()}
+                stage = await asyncio.to_thread(client.coordinator.checkpoint, scrutin.id, "uploaded", uploaded)
+                artifacts.update(uploaded)
+
+        scrutin.media_id = artifacts["media_id"]
+    except BaseException as e:
+        await asyncio.to_thread(client.coordinator.release, scrutin.id, isinstance(e, Exception))
+        raise
+
+    return scrutin
+
+
+def resume_stage(stage: Optional[str], artifacts: Dict[str, Any]) -> Optional[str]:
+    """
+    Find the stage a claimed scrutin resumes after: its last completed stage, rewound
+    while the artifact needed by the next stage is missing or the uploaded media expired.
+    Nothing is rewound once the scrutin is tweeted.
+
+    :param stage: The last completed stage of the scrutin.
+    :param artifacts: The artifacts recorded so far.
+    :return: The stage to resume after, None to start over.
+    """
+    if reached(stage, "uploaded") and not reached(stage, "tweeted"):
+        if time.time() - artifacts.get("uploaded_at", 0) > MEDIA_TTL:
+            stage = "rendered"
+    if stage == "rendered" and not os.path.exists(artifacts["image"]):
+        stage = "fetched"
+    if stage == "fetched" and not os.path.exists(artifacts["details"]):
+        stage = None
+    return stage
+
+
+async def publish_thread(client: client.Client, scrutin: Scrutin) -> None:
+    """
+    Publish the tweet of a prepared scrutin followed by its reply with the links, then
+    commit the scrutin.
+
+    Both tweets are checkpointed, so a resumed scrutin never tweets twice. The claim is
+    released as a failed attempt if the main tweet cannot be sent or is rejected by
+    twitter, a rejected scrutin uploads its media again on the next attempt in case it
+    expired. Otherwise, once a request is out, the claim is kept until committed or
+    expired. Once the main tweet is out the scrutin is committed even if the reply fails.
+
+    :param client: The client used to tweet.
+    :param scrutin: The scrutin returned by prepare_post.
+    """
+    stage, artifacts = await asyncio.to_thread(client.coordinator.progress, scrutin.id)
+
+    if not reached(stage, "tweeted"):
+        with logs.stage(scrutin.id, "tweeted"):
+            txt = short_tweet(scrutin)
+            try:
+                assert len(txt) <= 280, f"Tweet too long for scrutin {scrutin.id}"
+                await asyncio.to_thread(client.coordinator.renew, scrutin.id)
+            except BaseException as e:
+                await asyncio.to_thread(client.coordinator.release, scrutin.id, isinstance(e, Exception))
+                raise
+
+            try:
+                artifacts["tweet_id"] = await send_tweet(
+                    client,
+                    scrutin.id,
+                    "tweeted",
+                    "tweet_id",
+                    text=txt,
+                    media_ids=[scrutin.media_id] if scrutin.media_id else None,
+                )
+            except Exception as e:
+                if not rejected(e):
+                    raise
+                if scrutin.media_id:
+                    await asyncio.to_thread(client.coordinator.checkpoint, scrutin.id, "rendered")
+                await asyncio.to_thread(client.coordinator.release, scrutin.id, True)
+                raise
+            stage = "tweeted"
+
+    try:
+        if not reached(stage, "replied"):
+            with logs.stage(scrutin.id, "replied"):
+                await asyncio.to_thread(client.coordinator.renew, scrutin.id)
+                artifacts["reply_id"] = await send_tweet(
+                    client,
+                    scrutin.id,
+                    "replied",
+                    "reply_id",
+                    text=tweet_reply(scrutin),
+                    in_reply_to_tweet_id=artifacts["tweet_id"],
+                )
+    except ClaimLost:
+        raise
+    except Exception as e:
+        logger.error(f"Reply to tweet {artifacts['tweet_id']} failed for scrutin {scrutin.id}: {e}")
+
+    result = {key: artifacts[key] for key in ("media_id", "tweet_id", "reply_id") if key in artifacts}
+    await asyncio.to_thread(client.coordinator.commit, scrutin.id, result)
+    await asyncio.to_thread(remove_artifacts, scrutin.id)
+
+
+async def send_tweet(client: client.Client, scrutin_id: int, stage: str, artifact: str, **kwargs) -> str:
+    """
+    Send a tweet of a scrutin thread and checkpoint `stage` with the tweet id.
+
+    The tweet and its checkpoint run in a single job of the default executor, shielded
+    from the cancellation of the calling task: a tweet cannot be taken back once sent, so
+    it is checkpointed even if the bot is stopped meanwhile and the next claim of the
+    scrutin does not post it again.
+
+    :param client: The client used to tweet.
+    :param scrutin_id: The id of the claimed scrutin.
+    :param stage: The stage completed by the tweet.
+    :param artifact: The artifact recording the tweet id.
+    :param kwargs: The arguments of create_tweet.
+    :return: The id of the tweet.
+    """
+
+    def post() -> str:
+        tweet = client.tw_client.create_tweet(**kwargs)
+        client.coordinator.checkpoint(scrutin_id, stage, {artifact: tweet.data["id"]})
+        return tweet.data["id"]
+
+    return await asyncio.shield(asyncio.get_running_loop().run_in_executor(None, post))
+
+
+def rejected(error: Exception) -> bool:
+    """
+    Check if a tweet request failed because twitter answered it with a client error (bad
+    or expired media, duplicate, rate limit...), meaning nothing was posted. Any other
+    error, like a timeout, leaves the outcome unknown.
+
+    :param error: The error raised by the request.
+    :return: True if the tweet was rejected.
+    """
+    import tweepy
+
+    return isinstance(error, tweepy.errors.HTTPException) and error.response.status_code < 500
+
+
+def shutdown(client: client.Client) -> None:
+    """
+    Stop the scrutins tasks and give back what this replica holds to the other ones.
+
+    :param client: The client the tasks were started with.
+    """
+    get_scrutins_task.stop()
+    create_post.stop()
+    # ? the liveness lease is left to expire, the claims still held are taken over after its ttl
+    send_heartbeat.stop()
+
+    # ? a prefetched scrutin is released, either by prepare_post when cancelled or here
+    if pending := client.get_data("next_post"):
+        client.remove_data("next_post")
+        if not pending.done():
+            pending.cancel()
+        elif not pending.cancelled() and pending.exception() is None and pending.result():
+            client.coordinator.release(pending.result().id)
+
+    client.coordinator.release_lease(POLL_LEASE)
 
 
 async def get_scrutin_details(scrutin: Scrutin) -> ScrutinAnalyse:
@@ -132,7 +385,23 @@ def tweet_reply(scrutin: Scrutin) -> str:
     return rep
 
 
+@lru_cache(maxsize=None)
+def load_font(font: tuple[str, int]) -> ImageFont.FreeTypeFont:
+    """
+    Load a font once and cache it for the next renders.
+
+    :param font: One of the FONT_* constants, a (path, size) tuple.
+    :return: The loaded font.
+    """
+    from PIL import ImageFont
+
+    path, size = font
+    return ImageFont.truetype(path, size)
+
+
 def generate_vote_image(scrutin: Scrutin, scrutin_analyse: ScrutinAnalyse) -> BytesIO:
+    from PIL import Image, ImageDraw
+
     bg = Image.open("assets/bg_an.jpg").convert("RGB")
     width, height = bg.size
     draw = ImageDraw.Draw(bg)
@@ -140,14 +409,14 @@ def generate_vote_image(scrutin: Scrutin, scrutin_analyse: ScrutinAnalyse) -> By
     cleaned_name = clean_scrutin_name(scrutin.name)
     splited_name = wrap(cleaned_name, width=30)
     for i, line in enumerate(splited_name):
-        draw.text((410, 15 + i * 42), line, font=FONT_TITLE, fill="#233f6b")
+        draw.text((410, 15 + i * 42), line, font=load_font(FONT_TITLE), fill="#233f6b")
 
     date = datetime.strptime(scrutin.date, "%Y-%m-%d")
     boxed_text(
         draw,
         f"{date:%d/%m/%Y}",
         (10, 15),
-        FONT_TEXT,
+        load_font(FONT_TEXT),
         "#fcfcfc",
         "#233f6b",
     )
@@ -156,7 +425,7 @@ def generate_vote_image(scrutin: Scrutin, scrutin_analyse: ScrutinAnalyse) -> By
         draw,
         f"{scrutin.id}",
         (10, 140),
-        FONT_TEXT_SMALLER,
+        load_font(FONT_TEXT_SMALLER),
         "#fcfcfc",
         "#233f6b",
     )
@@ -184,37 +453,37 @@ def generate_vote_image(scrutin: Scrutin, scrutin_analyse: ScrutinAnalyse) -> By
         draw,
         reading,
         (700, 590),
-        FONT_TEXT,
+        load_font(FONT_TEXT),
         "#fcfcfc",
         "#2c2d32",
     )
 
     boxed_text(draw, "Détails du scrutin :", (10, 260),
-               FONT_TITLE, "#fcfcfc", "#2c2d32")
+               load_font(FONT_TITLE), "#fcfcfc", "#2c2d32")
 
     if scrutin.adopted:
         boxed_text(draw, f"{scrutin.vote_for}", (30, 335),
-                   FONT_NUMBERS, "#fcfcfc", "#5890bd")
+                   load_font(FONT_NUMBERS), "#fcfcfc", "#5890bd")
     else:
         draw.text((30, 335), f"{scrutin.vote_for}",
-                  font=FONT_NUMBERS, fill="#5890bd")
+                  font=load_font(FONT_NUMBERS), fill="#5890bd")
 
     if not scrutin.adopted:
         boxed_text(draw, f"{scrutin.vote_against}",
-                   (200, 335), FONT_NUMBERS, "#fcfcfc", "#ea707d")
+                   (200, 335), load_font(FONT_NUMBERS), "#fcfcfc", "#ea707d")
     else:
         draw.text((200, 335), f"{scrutin.vote_against}",
-                  font=FONT_NUMBERS, fill="#ea707d")
+                  font=load_font(FONT_NUMBERS), fill="#ea707d")
 
     draw.text((390, 335), f"{scrutin.vote_abstention}",
-              font=FONT_NUMBERS, fill="#696969")
+              font=load_font(FONT_NUMBERS), fill="#696969")
 
     draw.line([(10, 410), (450, 410)], fill="#2c2d32", width=3)
 
     draw.text(
         (200, 420),
         f"{scrutin.vote_abstention + scrutin.vote_against + scrutin.vote_for}",
-        font=FONT_NUMBERS,
+        font=load_font(FONT_NUMBERS),
         fill="#2c2d32",
     )
 